@@ -1,17 +1,51 @@
 
 from __future__ import print_function
 
+import ast
+import bisect
+import json
 import os
-from Util import betterRepr, simpleObjRepr, ObjAsDict, unicode
+from Util import simpleObjRepr, unicode, PY3
 from Log import log
 import numpy
 
+if PY3:
+  from sys import intern
+
+
+def _intern_error_keys(error):
+  """
+  There is one error dict per epoch, and all of them usually have the same keys.
+  By interning the keys, we store each key string only once.
+
+  :param dict[str,float] error:
+  :rtype: dict[str,float]
+  """
+  # In Python 2, only str (not unicode) can be interned.
+  return {(intern(k) if isinstance(k, str) else k): v for (k, v) in error.items()}
+
+
+def _relative_error(old_error, new_error, div_by_old):
+  """
+  :param float|numpy.ndarray old_error:
+  :param float|numpy.ndarray new_error:
+  :param bool div_by_old: see LearningRateControl.relativeErrorDivByOld
+  :rtype: float|numpy.ndarray
+  """
+  denom = abs(old_error if div_by_old else new_error)
+  # Python floats raise ZeroDivisionError, but numpy would silently give nan/inf. Be consistent.
+  if numpy.any(denom == 0):
+    raise ZeroDivisionError("relative error: error is 0")
+  return (new_error - old_error) / denom
+
 
 class LearningRateControl(object):
 
   need_error_info = True
 
-  class EpochData:
+  class EpochData(object):
+    __slots__ = ("learningRate", "error")  # we have one instance per epoch, so keep it small
+
     def __init__(self, learningRate, error=None):
       """
       :type learningRate: float
@@ -22,25 +56,32 @@ class LearningRateControl(object):
         error = {"old_format_score": error}
       if error is None:
         error = {}
-      self.error = error
+      self.error = _intern_error_keys(error)
 
     __repr__ = simpleObjRepr
 
+  # (kwarg name, config key, Config method, default). Subclasses extend this list.
+  _config_spec = [
+    ("defaultLearningRate", "learning_rate", "float", 1.0),
+    ("minLearningRate", "min_learning_rate", "float", 0.0),
+    ("errorMeasureKey", "learning_rate_control_error_measure", "value", None),
+    ("relativeErrorAlsoRelativeToLearningRate", "learning_rate_control_relative_error_relative_lr", "bool", False),
+    ("relativeErrorDivByOld", "learning_rate_control_relative_error_div_by_old", "bool", False),
+    ("minNumEpochsPerNewLearningRate", "learning_rate_control_min_num_epochs_per_new_lr", "int", 0),
+    ("filename", "learning_rate_file", "value", None),
+  ]
+
   @classmethod
   def load_initial_kwargs_from_config(cls, config):
     """
     :type config: Config.Config
     :rtype: dict[str]
     """
-    return {
-      "defaultLearningRate": config.float('learning_rate', 1.0),
-      "minLearningRate": config.float('min_learning_rate', 0.0),
-      "defaultLearningRates": config.typed_value('learning_rates') or config.float_list('learning_rates'),
-      "errorMeasureKey": config.value('learning_rate_control_error_measure', None),
-      "relativeErrorAlsoRelativeToLearningRate": config.bool('learning_rate_control_relative_error_relative_lr', False),
-      "minNumEpochsPerNewLearningRate": config.int("learning_rate_control_min_num_epochs_per_new_lr", 0),
-      "filename": config.value('learning_rate_file', None),
-    }
+    kwargs = {
+      name: getattr(config, config_func)(key, default)
+      for (name, key, config_func, default) in cls._config_spec}
+    kwargs["defaultLearningRates"] = config.typed_value('learning_rates') or config.float_list('learning_rates')
+    return kwargs
 
   @classmethod
   def load_initial_from_config(cls, config):
@@ -54,16 +95,25 @@ class LearningRateControl(object):
   def __init__(self, defaultLearningRate, minLearningRate=0.0, defaultLearningRates=None,
                errorMeasureKey=None,
                relativeErrorAlsoRelativeToLearningRate=False,
+               relativeErrorDivByOld=False,
                minNumEpochsPerNewLearningRate=0,
                filename=None):
     """
     :param float defaultLearningRate: default learning rate. usually for epoch 1
     :param list[float] | dict[int,float] defaultLearningRates: learning rates
     :param str errorMeasureKey: for getEpochErrorValue() the selector for EpochData.error which is a dict
+    :param bool relativeErrorDivByOld: relative error is (new - old) / |old|, instead of (new - old) / |new|
     :param int minNumEpochsPerNewLearningRate: if the lr was recently updated, use it for at least N epochs
     :param str filename: load from and save to file
     """
-    self.epochData = {}  # type: dict[int,LearningRateControl.EpochData]
+    self._epochData = {}  # type: dict[int,LearningRateControl.EpochData]
+    self._loaded = True  # nothing to load until we know the filename
+    # epoch -> (errorMeasureKey, error dict, len(error dict), resolved key), see getErrorKey()
+    self._error_key_cache = {}  # type: dict[int,(str|None,dict[str,float],int,str)]
+    self._epochs_sorted = []  # type: list[int]  # sorted keys of epochData, see _sortedEpochs()
+    self._dirty_epochs = set()  # type: set[int]  # changed via our own methods since the last save()
+    # epoch -> (learningRate, len(error)) as written to the file, None if no snapshot yet. See save().
+    self._written_state = None  # type: dict[int,(float|None,int)]|None
     self.defaultLearningRate = defaultLearningRate
     self.minLearningRate = minLearningRate
     if defaultLearningRates:
@@ -77,12 +127,14 @@ class LearningRateControl(object):
     self.defaultLearningRates = defaultLearningRates
     self.errorMeasureKey = errorMeasureKey
     self.relativeErrorAlsoRelativeToLearningRate = relativeErrorAlsoRelativeToLearningRate
+    self.relativeErrorDivByOld = relativeErrorDivByOld
     self.minNumEpochsPerNewLearningRate = minNumEpochsPerNewLearningRate
     self.filename = filename
     if filename:
       if os.path.exists(filename):
-        print("Learning-rate-control: loading file %s" % filename, file=log.v4)
-        self.load()
+        # The file is loaded lazily on first access of self.epochData, see _ensure_loaded().
+        # Like before, the loaded data replaces the default learning rates set above.
+        self._loaded = False
       else:
         print("Learning-rate-control: file %s does not exist yet" % filename, file=log.v4)
     else:
@@ -90,6 +142,41 @@ class LearningRateControl(object):
 
   __repr__ = simpleObjRepr
 
+  def _ensure_loaded(self):
+    """
+    Loads the epoch data from self.filename, if not done yet.
+    We do this lazily because the file can be big and often we do not need the history at all.
+    """
+    if self._loaded:
+      return
+    if self.filename and os.path.exists(self.filename):
+      print("Learning-rate-control: loading file %s" % self.filename, file=log.v4)
+      # This sets self._loaded via the epochData setter.
+      # If it fails, we are still not loaded, and never save over the file.
+      self.load()
+    else:
+      self._loaded = True
+
+  @property
+  def epochData(self):
+    """
+    :rtype: dict[int,LearningRateControl.EpochData]
+    """
+    self._ensure_loaded()
+    return self._epochData
+
+  @epochData.setter
+  def epochData(self, epochData):
+    """
+    :param dict[int,LearningRateControl.EpochData] epochData:
+    """
+    self._loaded = True
+    self._epochData = epochData
+    self._error_key_cache = {}
+    self._epochs_sorted = sorted(epochData.keys())
+    self._dirty_epochs = set()
+    self._written_state = None
+
   def __str__(self):
     return "%r, epoch data: %s, error key: %s" % \
            (self, ", ".join(["%i: %s" % (epoch, self.epochData[epoch])
@@ -115,12 +202,22 @@ class LearningRateControl(object):
       return self.minLearningRate
     return learningRate
 
+  def _sortedEpochs(self):
+    """
+    :return: sorted keys of self.epochData. this is cached, don't modify it
+    :rtype: list[int]
+    """
+    epochData = self.epochData
+    # epochData is public and can be extended from outside (e.g. see demo()),
+    # so rebuild if we get out of sync. Epochs are never removed.
+    if len(self._epochs_sorted) != len(epochData):
+      self._epochs_sorted = sorted(epochData.keys())
+    return self._epochs_sorted
+
   def _lastEpochsForEpoch(self, epoch, numEpochs):
-    lastEpochs = sorted([e for e in self.epochData.keys() if e < epoch])
-    if not lastEpochs:
-      return []
-    lastEpochs = lastEpochs[-numEpochs:]
-    return lastEpochs
+    epochs = self._sortedEpochs()
+    idx = bisect.bisect_left(epochs, epoch)
+    return epochs[max(idx - numEpochs, 0):idx]
 
   def getLearningRateForEpoch(self, epoch):
     """
@@ -141,29 +238,51 @@ class LearningRateControl(object):
     if epoch in self.epochData:
       if not self.epochData[epoch].learningRate:
         self.epochData[epoch].learningRate = learningRate
+        self._dirty_epochs.add(epoch)
     else:
+      epochs = self._sortedEpochs()
       self.epochData[epoch] = self.EpochData(learningRate)
+      bisect.insort(epochs, epoch)
+      self._dirty_epochs.add(epoch)
 
   def getLastEpoch(self, epoch):
-    epochs = sorted([e for e in self.epochData.keys() if e < epoch])
-    if not epochs:
+    """
+    :param int epoch:
+    :return: the last epoch < epoch for which we have data, or None
+    :rtype: int|None
+    """
+    epochs = self._sortedEpochs()
+    idx = bisect.bisect_left(epochs, epoch)
+    if idx == 0:
       return None
-    return epochs[-1]
+    return epochs[idx - 1]
 
   def getMostRecentLearningRate(self, epoch, excludeCurrent=True):
-    for e, data in reversed(sorted(self.epochData.items())):
-      if e > epoch: continue
-      if excludeCurrent and e == epoch: continue
+    epochs = self._sortedEpochs()
+    if excludeCurrent:
+      idx = bisect.bisect_left(epochs, epoch)
+    else:
+      idx = bisect.bisect_right(epochs, epoch)
+    for i in reversed(range(idx)):
+      data = self.epochData[epochs[i]]
       if data.learningRate is None: continue
       return data.learningRate
     return self.defaultLearningRate
 
+  def _relativeError(self, oldError, newError):
+    """
+    :param float|numpy.ndarray oldError:
+    :param float|numpy.ndarray newError:
+    :rtype: float|numpy.ndarray
+    """
+    return _relative_error(oldError, newError, div_by_old=self.relativeErrorDivByOld)
+
   def calcRelativeError(self, oldEpoch, newEpoch):
     oldError = self.getEpochErrorValue(oldEpoch)
     newError = self.getEpochErrorValue(newEpoch)
     if oldError is None or newError is None:
       return None
-    relativeError = (newError - oldError) / abs(newError)
+    relativeError = self._relativeError(oldError, newError)
     if self.relativeErrorAlsoRelativeToLearningRate:
       learningRate = self.getMostRecentLearningRate(newEpoch, excludeCurrent=False)
       # If the learning rate is lower than the initial learning rate,
@@ -171,6 +290,49 @@ class LearningRateControl(object):
       relativeError /= learningRate / self.defaultLearningRate
     return relativeError
 
+  def calcRelativeErrors(self, epochs):
+    """
+    Like calcRelativeError() for all consecutive pairs of epochs, but vectorized.
+
+    :param list[int] epochs: sorted
+    :return: relative errors, shape (len(epochs)-1,), or None if some error is unknown
+    :rtype: numpy.ndarray|None
+    """
+    errors = [self.getEpochErrorValue(epoch) for epoch in epochs]
+    if any([e is None for e in errors]):
+      return None
+    errors = numpy.array(errors, dtype="float64")
+    relativeErrors = self._relativeError(errors[:-1], errors[1:])
+    if self.relativeErrorAlsoRelativeToLearningRate:
+      learningRates = numpy.array(
+        [self.getMostRecentLearningRate(epoch, excludeCurrent=False) for epoch in epochs[1:]], dtype="float64")
+      if numpy.any(learningRates == 0):  # like calcRelativeError()
+        raise ZeroDivisionError("relative error relative to learning rate: learning rate is 0")
+      relativeErrors /= learningRates / self.defaultLearningRate
+    return relativeErrors
+
+  def _getLastTwoEpochErrors(self, epoch):
+    """
+    Common logic for the Newbob variants.
+
+    :param int epoch: the epoch we want to calculate the learning rate for
+    :return: (learningRate, oldError, newError), where learningRate is the one of the last epoch
+      (or the default one), and the errors are of the two last epochs, or None if not available
+    :rtype: (float, float|None, float|None)
+    """
+    epochs = self._sortedEpochs()
+    idx = bisect.bisect_left(epochs, epoch)
+    if idx == 0:
+      return self.defaultLearningRate, None, None
+    learningRate = self.epochData[epochs[idx - 1]].learningRate
+    if learningRate is None:
+      return self.defaultLearningRate, None, None
+    if idx == 1:
+      return learningRate, None, None
+    oldError = self.getEpochErrorValue(epochs[idx - 2])
+    newError = self.getEpochErrorValue(epochs[idx - 1])
+    return learningRate, oldError, newError
+
   def setEpochError(self, epoch, error):
     """
     :type epoch: int
@@ -192,16 +354,37 @@ class LearningRateControl(object):
           error[k + "_" + k1] = v1
     for v in error.values():
       assert isinstance(v, float)
-    self.epochData[epoch].error.update(error)
+    self.epochData[epoch].error.update(_intern_error_keys(error))
+    self._error_key_cache.pop(epoch, None)
+    self._dirty_epochs.add(epoch)
     if epoch == 1:
       print("Learning-rate-control: error key %r from %r" % (self.getErrorKey(epoch), error), file=log.v4)
 
   def getErrorKey(self, epoch):
+    """
+    :param int epoch:
+    :return: the key for EpochData.error which we use for getEpochErrorValue()
+    :rtype: str|None
+    """
     if epoch not in self.epochData:
       return self.errorMeasureKey
     epoch_data = self.epochData[epoch]
     if not epoch_data.error:
       return None
+    # epochData can also be modified from outside, so check that the error dict is still the same.
+    cached = self._error_key_cache.get(epoch)
+    if (cached is not None and cached[0] == self.errorMeasureKey and
+            cached[1] is epoch_data.error and cached[2] == len(epoch_data.error)):
+      return cached[3]
+    key = self._calcErrorKey(epoch_data)
+    self._error_key_cache[epoch] = (self.errorMeasureKey, epoch_data.error, len(epoch_data.error), key)
+    return key
+
+  def _calcErrorKey(self, epoch_data):
+    """
+    :param LearningRateControl.EpochData epoch_data: with non-empty error dict
+    :rtype: str
+    """
     if len(epoch_data.error) == 1 and "old_format_score" in epoch_data.error:
       return "old_format_score"
     if self.errorMeasureKey:
@@ -258,22 +441,114 @@ class LearningRateControl(object):
       return None
     return min(values)[1]
 
+  def _epochRecordStr(self, epoch):
+    """
+    :param int epoch:
+    :return: one line (without newline) for the file, see save()
+    :rtype: str
+    """
+    data = self.epochData[epoch]
+    return json.dumps({"epoch": epoch, "learningRate": data.learningRate, "error": data.error}, sort_keys=True)
+
   def save(self):
+    """
+    The file contains one JSON record per line, one per epoch. Later records overwrite earlier ones.
+    The first save() writes a full snapshot of the epoch data,
+    all further calls only append the changed epochs.
+    Changed are the epochs modified via setDefaultLearningRateForEpoch() or setEpochError().
+    As epochData can also be modified from outside, we additionally compare (learningRate, len(error))
+    with what we have written. This is a cheap O(N) scan, but only the changed epochs are serialized.
+    Note that an outside change of only an error value (same keys) is not detected.
+    """
     if not self.filename: return
+    epochData = self.epochData
+    state = {epoch: (data.learningRate, len(data.error)) for (epoch, data) in epochData.items()}
+    if self._written_state is not None and os.path.exists(self.filename):
+      changed = [
+        epoch for epoch in self._sortedEpochs()
+        if epoch in self._dirty_epochs or self._written_state.get(epoch) != state[epoch]]
+      if changed:
+        f = open(self.filename, "a")
+        for epoch in changed:
+          f.write(self._epochRecordStr(epoch) + "\n")
+        f.close()
+      self._written_state = state
+      self._dirty_epochs.clear()
+      return
     # First write to a temp-file, to be sure that the write happens without errors.
     # Otherwise, it could happen that we delete the old existing file, then
     # some error happens (e.g. disk quota), and we loose the newbob data.
     # Loosing that data is very bad because it basically means that we have to redo all the training.
     tmp_filename = self.filename + ".new_tmp"
     f = open(tmp_filename, "w")
-    f.write(betterRepr(self.epochData))
-    f.write("\n")
+    for epoch in self._sortedEpochs():
+      f.write(self._epochRecordStr(epoch) + "\n")
     f.close()
     os.rename(tmp_filename, self.filename)
+    self._written_state = state
+    self._dirty_epochs.clear()
 
   def load(self):
     s = open(self.filename).read()
-    self.epochData = eval(s, {"nan": float("nan")}, ObjAsDict(self))
+    epochData = self._parse_epoch_records(s)
+    if epochData is None:
+      try:
+        raw = json.loads(s)  # Old format, a single JSON dict.
+      except ValueError:  # Old format, written via betterRepr.
+        epochData = self._parse_legacy_epoch_data(s)
+      else:
+        epochData = {
+          int(epoch): self.EpochData(learningRate=v["learningRate"], error=v["error"])
+          for (epoch, v) in raw.items()}
+    self.epochData = epochData
+
+  def _parse_epoch_records(self, s):
+    """
+    Parses the format written by save(), i.e. one JSON record per line.
+
+    :param str s: file content
+    :return: epoch data, or None if this is not the format
+    :rtype: dict[int,LearningRateControl.EpochData]|None
+    """
+    lines = [line for line in s.splitlines() if line.strip()]
+    epochData = {}
+    for i, line in enumerate(lines):
+      try:
+        record = json.loads(line)
+      except ValueError:
+        if 0 < i == len(lines) - 1:  # We probably crashed while appending.
+          print("Learning-rate-control: ignoring incomplete last line in %s" % self.filename, file=log.v3)
+          break
+        return None
+      if not isinstance(record, dict) or "epoch" not in record:
+        return None
+      epochData[int(record["epoch"])] = self.EpochData(learningRate=record["learningRate"], error=record["error"])
+    return epochData
+
+  def _parse_legacy_epoch_data(self, s):
+    """
+    Parses the old file format, which is like "{1: EpochData(learningRate=0.1, error={...}), ...}".
+    We never eval() it but only accept literals, the EpochData constructor and nan/inf.
+
+    :param str s: file content
+    :rtype: dict[int,LearningRateControl.EpochData]
+    """
+    def _literal(node):
+      if isinstance(node, ast.Dict):
+        return {_literal(k): _literal(v) for (k, v) in zip(node.keys, node.values)}
+      if isinstance(node, ast.Name) and node.id in ("nan", "inf"):
+        return float(node.id)
+      if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_literal(node.operand)
+      if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "EpochData":
+        args = [_literal(arg) for arg in node.args]
+        kwargs = {kw.arg: _literal(kw.value) for kw in node.keywords}
+        return self.EpochData(*args, **kwargs)
+      return ast.literal_eval(node)
+
+    epochData = _literal(ast.parse(s.strip(), mode="eval").body)
+    assert isinstance(epochData, dict), "invalid learning-rate file %r" % self.filename
+    return epochData
 
 
 class ConstantLearningRate(LearningRateControl):
@@ -300,17 +575,10 @@ class ConstantLearningRate(LearningRateControl):
 
 class NewbobRelative(LearningRateControl):
 
-  @classmethod
-  def load_initial_kwargs_from_config(cls, config):
-    """
-    :type config: Config.Config
-    :rtype: dict[str]
-    """
-    kwargs = super(NewbobRelative, cls).load_initial_kwargs_from_config(config)
-    kwargs.update({
-      "relativeErrorThreshold": config.float('newbob_relative_error_threshold', -0.01),
-      "learningRateDecayFactor": config.float('newbob_learning_rate_decay', 0.5)})
-    return kwargs
+  _config_spec = LearningRateControl._config_spec + [
+    ("relativeErrorThreshold", "newbob_relative_error_threshold", "float", -0.01),
+    ("learningRateDecayFactor", "newbob_learning_rate_decay", "float", 0.5),
+  ]
 
   def __init__(self, relativeErrorThreshold, learningRateDecayFactor, **kwargs):
     """
@@ -330,36 +598,71 @@ class NewbobRelative(LearningRateControl):
     :returns learning rate
     :rtype: float
     """
-    lastEpoch = self.getLastEpoch(epoch)
-    if lastEpoch is None:
-      return self.defaultLearningRate
-    learningRate = self.epochData[lastEpoch].learningRate
-    if learningRate is None:
-      return self.defaultLearningRate
-    last2Epoch = self.getLastEpoch(lastEpoch)
-    if last2Epoch is None:
-      return learningRate
-    relativeError = self.calcRelativeError(last2Epoch, lastEpoch)
-    if relativeError is None:
+    learningRate, oldError, newError = self._getLastTwoEpochErrors(epoch)
+    if oldError is None or newError is None:
       return learningRate
+    relativeError = self._relativeError(oldError, newError)
+    if self.relativeErrorAlsoRelativeToLearningRate:
+      # Same as in calcRelativeError(). learningRate is the one of the last epoch.
+      relativeError /= learningRate / self.defaultLearningRate
     if relativeError > self.relativeErrorThreshold:
       learningRate *= self.learningRateDecayFactor
     return learningRate
 
+  @classmethod
+  def simulate_batch(cls, errors, relativeErrorThresholds, learningRateDecayFactors, defaultLearningRate,
+                     minLearningRate=0.0, relativeErrorDivByOld=False, relativeErrorAlsoRelativeToLearningRate=False):
+    """
+    Replays the given error history for K schedules with different hyper parameters at once,
+    e.g. to evaluate a grid of Newbob settings offline.
+    This gives the same learning rates as getLearningRateForEpoch() of K separate instances,
+    when the errors are set for each epoch (minNumEpochsPerNewLearningRate is not supported).
+    Like there, an error of 0 in the denominator of the relative error raises ZeroDivisionError.
+
+    :param numpy.ndarray|list[float] errors: shape (E,). errors[i] is the error of epoch i+1
+    :param numpy.ndarray|list[float] relativeErrorThresholds: shape (K,)
+    :param numpy.ndarray|list[float] learningRateDecayFactors: shape (K,)
+    :param float defaultLearningRate:
+    :param float minLearningRate:
+    :param bool relativeErrorDivByOld: see LearningRateControl.__init__
+    :param bool relativeErrorAlsoRelativeToLearningRate: see LearningRateControl.__init__
+    :return: learning rates, shape (K,E). [k,i] is the learning rate of schedule k in epoch i+1
+    :rtype: numpy.ndarray
+    """
+    errors = numpy.asarray(errors, dtype="float64")
+    relativeErrorThresholds = numpy.asarray(relativeErrorThresholds, dtype="float64")
+    learningRateDecayFactors = numpy.asarray(learningRateDecayFactors, dtype="float64")
+    assert errors.ndim == 1 and relativeErrorThresholds.ndim == 1
+    assert relativeErrorThresholds.shape == learningRateDecayFactors.shape
+    numEpochs = errors.shape[0]
+    # Epoch i+1 (i >= 2) uses the errors of epochs i-1 and i, i.e. the last error is never used.
+    # shape (max(E-2, 0),), independent of the schedule
+    if numEpochs >= 3:
+      relativeErrors = _relative_error(errors[:-2], errors[1:-1], div_by_old=relativeErrorDivByOld)
+    else:
+      relativeErrors = errors[:0]
+    learningRates = numpy.full(relativeErrorThresholds.shape, max(defaultLearningRate, minLearningRate))
+    out = numpy.empty(relativeErrorThresholds.shape + (numEpochs,), dtype="float64")
+    out[:, :min(numEpochs, 2)] = learningRates[:, None]
+    for i in range(2, numEpochs):
+      relativeError = relativeErrors[i - 2]
+      if relativeErrorAlsoRelativeToLearningRate:
+        if numpy.any(learningRates == 0):  # like calcRelativeError()
+          raise ZeroDivisionError("relative error relative to learning rate: learning rate is 0")
+        relativeError = relativeError / (learningRates / defaultLearningRate)
+      learningRates = numpy.where(
+        relativeError > relativeErrorThresholds, learningRates * learningRateDecayFactors, learningRates)
+      learningRates = numpy.maximum(learningRates, minLearningRate)
+      out[:, i] = learningRates
+    return out
+
 
 class NewbobAbs(LearningRateControl):
 
-  @classmethod
-  def load_initial_kwargs_from_config(cls, config):
-    """
-    :type config: Config.Config
-    :rtype: dict[str]
-    """
-    kwargs = super(NewbobAbs, cls).load_initial_kwargs_from_config(config)
-    kwargs.update({
-      "errorThreshold": config.float('newbob_error_threshold', -0.01),
-      "learningRateDecayFactor": config.float('newbob_learning_rate_decay', 0.5)})
-    return kwargs
+  _config_spec = LearningRateControl._config_spec + [
+    ("errorThreshold", "newbob_error_threshold", "float", -0.01),
+    ("learningRateDecayFactor", "newbob_learning_rate_decay", "float", 0.5),
+  ]
 
   def __init__(self, errorThreshold, learningRateDecayFactor, **kwargs):
     """
@@ -377,17 +680,7 @@ class NewbobAbs(LearningRateControl):
     :returns learning rate
     :rtype: float
     """
-    lastEpoch = self.getLastEpoch(epoch)
-    if lastEpoch is None:
-      return self.defaultLearningRate
-    learningRate = self.epochData[lastEpoch].learningRate
-    if learningRate is None:
-      return self.defaultLearningRate
-    last2Epoch = self.getLastEpoch(lastEpoch)
-    if last2Epoch is None:
-      return learningRate
-    oldError = self.getEpochErrorValue(last2Epoch)
-    newError = self.getEpochErrorValue(lastEpoch)
+    learningRate, oldError, newError = self._getLastTwoEpochErrors(epoch)
     if oldError is None or newError is None:
       return learningRate
     errorDiff = newError - oldError
@@ -398,6 +691,13 @@ class NewbobAbs(LearningRateControl):
 
 class NewbobMultiEpoch(LearningRateControl):
 
+  _config_spec = LearningRateControl._config_spec + [
+    ("numEpochs", "newbob_multi_num_epochs", "int", 5),
+    ("relativeErrorThreshold", "newbob_relative_error_threshold", "float", -0.01),
+    ("learningRateDecayFactor", "newbob_learning_rate_decay", "float", 0.5),
+    ("learningRateGrowthFactor", "newbob_learning_rate_growth", "float", 1.0),
+  ]
+
   @classmethod
   def load_initial_kwargs_from_config(cls, config):
     """
@@ -405,13 +705,8 @@ class NewbobMultiEpoch(LearningRateControl):
     :rtype: dict[str]
     """
     kwargs = super(NewbobMultiEpoch, cls).load_initial_kwargs_from_config(config)
-    kwargs.update({
-      "numEpochs": config.int("newbob_multi_num_epochs", 5),
-      "updateInterval": config.int("newbob_multi_update_interval", config.int("newbob_multi_num_epochs", 5)),
-      "relativeErrorThreshold": config.float('newbob_relative_error_threshold', -0.01),
-      "learningRateDecayFactor": config.float('newbob_learning_rate_decay', 0.5),
-      "learningRateGrowthFactor": config.float('newbob_learning_rate_growth', 1.0),
-      })
+    # By default, same as numEpochs.
+    kwargs["updateInterval"] = config.int("newbob_multi_update_interval", kwargs["numEpochs"])
     return kwargs
 
   def __init__(self, numEpochs,  updateInterval,
@@ -440,8 +735,8 @@ class NewbobMultiEpoch(LearningRateControl):
     :rtype: float|None
     """
     assert len(epochs) >= 2
-    errors = [self.calcRelativeError(epochs[i], epochs[i + 1]) for i in range(len(epochs) - 1)]
-    if any([e is None for e in errors]):
+    errors = self.calcRelativeErrors(epochs)
+    if errors is None:
       return None
     return numpy.mean(errors)
 
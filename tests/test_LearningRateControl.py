@@ -5,6 +5,7 @@ sys.path += ["."]  # Python 3 hack
 from Config import Config
 from LearningRateControl import *
 from nose.tools import assert_equal
+import numpy
 
 import better_exchook
 better_exchook.replace_traceback_format_tb()
@@ -113,3 +114,267 @@ def test_newbob_multi_epoch():
     'train_score': 3.095824052426714,
   })
   assert_equal(lrc.getLearningRateForEpoch(2), lr)  # epoch 2 cannot be a different lr yet
+
+
+def test_lazy_load():
+  import tempfile
+  with tempfile.NamedTemporaryFile(mode="w", suffix=".data") as f:
+    f.write("{1: EpochData(learningRate=0.1, error={'dev_score': 2.0}),\n 2: EpochData(learningRate=0.1, error={'dev_score': 1.0})}\n")
+    f.flush()
+    lrc = ConstantLearningRate(defaultLearningRate=0.5, filename=f.name)
+    assert not lrc._loaded
+    assert_equal(lrc.getLearningRateForEpoch(1), 0.1)
+    assert lrc._loaded
+    assert_equal(lrc.getLearningRateForEpoch(3), 0.1)
+    assert_equal(lrc.getEpochErrorValue(2), 1.0)
+
+
+def test_save_load():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    filename = "%s/learning_rates" % tmp_dir
+    lrc = NewbobRelative(
+      defaultLearningRate=0.1, relativeErrorThreshold=-0.01, learningRateDecayFactor=0.5, filename=filename)
+    lrc.getLearningRateForEpoch(1)
+    lrc.setEpochError(1, {"dev_score": 2.0, "train_score": float("nan")})
+    lrc.getLearningRateForEpoch(2)
+    lrc.setEpochError(2, {"dev_score": 1.99, "train_score": 1.5})
+    lrc.save()
+    lrc2 = NewbobRelative(
+      defaultLearningRate=0.1, relativeErrorThreshold=-0.01, learningRateDecayFactor=0.5, filename=filename)
+    assert_equal(sorted(lrc2.epochData.keys()), [1, 2])
+    assert_equal(lrc2.getEpochErrorValue(2), 1.99)
+    assert_equal(lrc2.getLearningRateForEpoch(3), 0.05)
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_error_key_update():
+  lrc = NewbobRelative(defaultLearningRate=0.1, relativeErrorThreshold=-0.01, learningRateDecayFactor=0.5)
+  lrc.getLearningRateForEpoch(1)
+  lrc.setEpochError(1, {"train_score": 1.9})
+  assert_equal(lrc.getErrorKey(1), "train_score")
+  lrc.setEpochError(1, {"dev_score": 1.99, "dev_error": 0.6})
+  assert_equal(lrc.getErrorKey(1), "dev_score")
+  lrc.errorMeasureKey = "dev_error"
+  assert_equal(lrc.getErrorKey(1), "dev_error")
+
+
+
+def test_error_key_external_modification():
+  lrc = NewbobRelative(defaultLearningRate=0.1, relativeErrorThreshold=-0.01, learningRateDecayFactor=0.5)
+  lrc.getLearningRateForEpoch(1)
+  lrc.setEpochError(1, {"train_score": 1.0})
+  assert_equal(lrc.getEpochErrorValue(1), 1.0)
+  lrc.epochData[1] = lrc.EpochData(0.1, {"dev_score": 2.0})
+  assert_equal(lrc.getEpochErrorValue(1), 2.0)
+  lrc.epochData[1].error["train_score"] = 1.0
+  assert_equal(lrc.getErrorKey(1), "dev_score")
+
+
+def test_last_epoch():
+  lrc = ConstantLearningRate(defaultLearningRate=0.1)
+  assert_equal(lrc.getLastEpoch(1), None)
+  lrc.setDefaultLearningRateForEpoch(3, 0.3)
+  lrc.setDefaultLearningRateForEpoch(1, 0.1)
+  lrc.epochData[5] = lrc.EpochData(learningRate=None)
+  assert_equal(lrc.getLastEpoch(1), None)
+  assert_equal(lrc.getLastEpoch(3), 1)
+  assert_equal(lrc.getLastEpoch(4), 3)
+  assert_equal(lrc.getLastEpoch(10), 5)
+  assert_equal(lrc._lastEpochsForEpoch(10, numEpochs=2), [3, 5])
+  assert_equal(lrc.getMostRecentLearningRate(5, excludeCurrent=False), 0.3)
+  assert_equal(lrc.getMostRecentLearningRate(3), 0.1)
+
+
+def test_calc_relative_errors():
+  lrc = NewbobMultiEpoch(
+    defaultLearningRate=0.1, relativeErrorAlsoRelativeToLearningRate=True,
+    numEpochs=3, updateInterval=1, relativeErrorThreshold=-0.01, learningRateDecayFactor=0.5)
+  for epoch, (lr, score) in enumerate([(0.1, 2.0), (0.1, 1.9), (0.05, 1.85), (0.05, 1.84)]):
+    lrc.setDefaultLearningRateForEpoch(epoch + 1, lr)
+    lrc.setEpochError(epoch + 1, {"dev_score": score})
+  epochs = [1, 2, 3, 4]
+  errors = lrc.calcRelativeErrors(epochs)
+  assert_equal(len(errors), 3)
+  for i in range(3):
+    numpy.testing.assert_allclose(errors[i], lrc.calcRelativeError(epochs[i], epochs[i + 1]))
+  lrc.getLearningRateForEpoch(5)
+  assert_equal(lrc.calcRelativeErrors([4, 5]), None)
+  lrc.setEpochError(5, {"dev_score": 0.0})
+  for func in [lambda: lrc.calcRelativeError(4, 5), lambda: lrc.calcRelativeErrors([3, 4, 5])]:
+    try:
+      func()
+    except ZeroDivisionError:
+      pass
+    else:
+      assert False, "expected ZeroDivisionError"
+
+
+def test_save_incremental():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    filename = "%s/learning_rates" % tmp_dir
+    lrc = ConstantLearningRate(defaultLearningRate=0.1, filename=filename)
+    for epoch in range(1, 4):
+      lrc.getLearningRateForEpoch(epoch)
+      lrc.setEpochError(epoch, {"train_score": 1.0 / epoch})
+      lrc.save()
+      lrc.setEpochError(epoch, {"dev_score": 2.0 / epoch})
+      lrc.save()
+    lines = open(filename).read().splitlines()
+    assert_equal(len(lines), 6)  # snapshot with epoch 1, then appended records
+    with open(filename, "a") as f:
+      f.write('{"epoch": 4, "learn')  # incomplete write
+    lrc2 = ConstantLearningRate(defaultLearningRate=0.1, filename=filename)
+    assert_equal(sorted(lrc2.epochData.keys()), [1, 2, 3])
+    assert_equal(lrc2.getEpochErrorDict(3), {"train_score": 1.0 / 3, "dev_score": 2.0 / 3})
+    lrc2.save()  # compacts the file
+    assert_equal(len(open(filename).read().splitlines()), 3)
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_newbob_abs():
+  lrc = NewbobAbs(defaultLearningRate=0.1, errorThreshold=-0.1, learningRateDecayFactor=0.5)
+  assert_equal(lrc.getLearningRateForEpoch(1), 0.1)
+  lrc.setEpochError(1, {"dev_score": 2.0})
+  assert_equal(lrc.getLearningRateForEpoch(2), 0.1)
+  lrc.setEpochError(2, {"dev_score": 1.5})
+  assert_equal(lrc.getLearningRateForEpoch(3), 0.1)
+  lrc.setEpochError(3, {"dev_score": 1.45})
+  assert_equal(lrc.getLearningRateForEpoch(4), 0.05)
+
+
+def test_load_initial_kwargs_from_config():
+  config = Config()
+  config.update({
+    "learning_rate_control": "newbob_multi_epoch",
+    "newbob_multi_num_epochs": 3,
+    "newbob_learning_rate_decay": 0.7,
+    "learning_rate": 0.01})
+  lrc = loadLearningRateControlFromConfig(config)
+  assert isinstance(lrc, NewbobMultiEpoch)
+  assert_equal(lrc.defaultLearningRate, 0.01)
+  assert_equal(lrc.numEpochs, 3)
+  assert_equal(lrc.updateInterval, 3)
+  assert_equal(lrc.learningRateDecayFactor, 0.7)
+  assert_equal(lrc.relativeErrorThreshold, -0.01)
+  assert_equal(lrc.errorMeasureKey, None)
+
+
+def test_epoch_data_slots():
+  data = LearningRateControl.EpochData(learningRate=0.1, error={"dev_score": 1.0})
+  assert not hasattr(data, "__dict__")
+  data.learningRate = 0.2
+  assert_equal(data.learningRate, 0.2)
+
+
+def test_newbob_relative_error_div_by_old():
+  config = Config()
+  config.update({
+    "learning_rate_control": "newbob", "learning_rate": 0.1,
+    "learning_rate_control_relative_error_div_by_old": True})
+  lrc = loadLearningRateControlFromConfig(config)
+  assert lrc.relativeErrorDivByOld
+  lrc.getLearningRateForEpoch(1)
+  lrc.setEpochError(1, {"dev_score": 2.0})
+  lrc.getLearningRateForEpoch(2)
+  lrc.setEpochError(2, {"dev_score": 1.0})
+  assert_equal(lrc.calcRelativeError(1, 2), -0.5)
+  numpy.testing.assert_allclose(lrc.calcRelativeErrors([1, 2]), [-0.5])
+  assert_equal(lrc.getLearningRateForEpoch(3), 0.1)
+
+
+def test_newbob_simulate_batch():
+  errors = [2.0, 1.9, 1.89, 1.7, 1.695, 1.694, 1.5]
+  thresholds = [-0.01, -0.05, 0.0]
+  decays = [0.5, 0.7, 0.9]
+  for relative_lr in [False, True]:
+    lrs = NewbobRelative.simulate_batch(
+      errors, thresholds, decays, defaultLearningRate=0.1, minLearningRate=0.02,
+      relativeErrorAlsoRelativeToLearningRate=relative_lr)
+    assert_equal(lrs.shape, (3, len(errors)))
+    for k in range(3):
+      lrc = NewbobRelative(
+        defaultLearningRate=0.1, minLearningRate=0.02, relativeErrorAlsoRelativeToLearningRate=relative_lr,
+        relativeErrorThreshold=thresholds[k], learningRateDecayFactor=decays[k])
+      for epoch, error in enumerate(errors):
+        numpy.testing.assert_allclose(lrs[k, epoch], lrc.getLearningRateForEpoch(epoch + 1))
+        lrc.setEpochError(epoch + 1, {"dev_score": error})
+  # The last error is never used, so a zero there is fine, like with a single instance.
+  for errors in [[0.0], [2.0, 0.0], [2.0, 1.9, 0.0]]:
+    lrs = NewbobRelative.simulate_batch(errors, thresholds, decays, defaultLearningRate=0.1)
+    assert_equal(lrs.shape, (3, len(errors)))
+    for k in range(3):
+      lrc = NewbobRelative(
+        defaultLearningRate=0.1, relativeErrorThreshold=thresholds[k], learningRateDecayFactor=decays[k])
+      for epoch, error in enumerate(errors):
+        numpy.testing.assert_allclose(lrs[k, epoch], lrc.getLearningRateForEpoch(epoch + 1))
+        lrc.setEpochError(epoch + 1, {"dev_score": error})
+  try:
+    NewbobRelative.simulate_batch([2.0, 0.0, 1.0], thresholds, decays, defaultLearningRate=0.1)
+  except ZeroDivisionError:
+    pass
+  else:
+    assert False, "expected ZeroDivisionError"
+
+
+def test_error_keys_interned():
+  lrc = ConstantLearningRate(defaultLearningRate=0.1)
+  for epoch in [1, 2]:
+    lrc.getLearningRateForEpoch(epoch)
+    lrc.setEpochError(epoch, {"".join(["dev", "_score"]): 1.0})
+  key1, = lrc.getEpochErrorDict(1).keys()
+  key2, = lrc.getEpochErrorDict(2).keys()
+  assert key1 is key2
+
+
+def test_load_failure_does_not_overwrite():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    filename = "%s/learning_rates" % tmp_dir
+    content = "{1: EpochData(learningRate=0.1, error={'dev_score': 2.0}),\n 2: garbage(\n"
+    with open(filename, "w") as f:
+      f.write(content)
+    lrc = ConstantLearningRate(defaultLearningRate=0.5, defaultLearningRates=[0.3], filename=filename)
+    for func in [lambda: lrc.getLearningRateForEpoch(1), lrc.save]:
+      try:
+        func()
+      except Exception:
+        pass
+      else:
+        assert False, "expected the load to fail"
+      assert not lrc._loaded
+      assert_equal(open(filename).read(), content)
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_save_external_modification():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    filename = "%s/learning_rates" % tmp_dir
+    lrc = ConstantLearningRate(defaultLearningRate=0.1, filename=filename)
+    lrc.getLearningRateForEpoch(1)
+    lrc.setEpochError(1, {"dev_score": 2.0})
+    lrc.save()
+    lrc.epochData[2] = lrc.EpochData(0.05, {"dev_score": 1.5})
+    lrc.epochData[1].learningRate = 0.2
+    lrc.save()
+    assert_equal(len(open(filename).read().splitlines()), 3)
+    lrc2 = ConstantLearningRate(defaultLearningRate=0.1, filename=filename)
+    assert_equal(sorted(lrc2.epochData.keys()), [1, 2])
+    assert_equal(lrc2.epochData[1].learningRate, 0.2)
+    assert_equal(lrc2.epochData[2].learningRate, 0.05)
+    assert_equal(lrc2.getEpochErrorValue(2), 1.5)
+  finally:
+    shutil.rmtree(tmp_dir)